@@ -1,10 +1,18 @@
 
+import io
+
 from docx import Document
 from docx.shared import Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml.ns import qn
 from docx.shared import Pt
 
+# Line markers, matched against the first space-separated token of each line
+HEADING_LEVELS = {"# ": 0, "## ": 1, "### ": 2}
+CODE_FENCE = "```"
+LIST_MARKER = "* "
+IMAGE_PLACEHOLDER = "**[图片占位："
+
 def create_manual_docx(markdown_file, output_file):
     document = Document()
 
@@ -25,64 +33,54 @@ def create_manual_docx(markdown_file, output_file):
     # For now, we\'ll just add a placeholder or rely on Word\'s default page numbering.
     # A more robust solution would involve manipulating XML directly or using a template with fields.
 
-    with open(markdown_file, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    lines = content.split("\n")
-    
     in_code_block = False
-    current_paragraph_lines = []
+    # Text of the paragraph being accumulated; the same buffer is reused for every paragraph
+    paragraph = io.StringIO()
+
+    def flush_paragraph():
+        if paragraph.tell():
+            document.add_paragraph(paragraph.getvalue())
+            paragraph.seek(0)
+            paragraph.truncate(0)
 
-    for line in lines:
-        if line.startswith("# "): # Main title
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
-            document.add_heading(line.replace("# ", "").strip(), level=0)
-        elif line.startswith("## "): # Section heading
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
-            document.add_heading(line.replace("## ", "").strip(), level=1)
-        elif line.startswith("### "): # Sub-section heading
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
-            document.add_heading(line.replace("### ", "").strip(), level=2)
-        elif line.startswith("```"): # Code block start/end
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
-            in_code_block = not in_code_block
-            if not in_code_block: # End of code block
-                document.add_paragraph("") # Add an empty paragraph after code block
-        elif in_code_block:
-            document.add_paragraph(line)
-        elif line.startswith("*   "): # List item
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
-            document.add_paragraph(line.replace("*   ", "- ", 1), style="List Bullet")
-        elif line.startswith("**[图片占位："): # Image placeholder
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
-            document.add_paragraph(line)
-        elif line.strip() == "---":
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
-            document.add_paragraph("") # Add a separator or new paragraph
-        elif line.strip(): # Regular paragraph line
-            current_paragraph_lines.append(line.strip())
-        else: # Empty line, end of paragraph
-            if current_paragraph_lines:
-                document.add_paragraph(" ".join(current_paragraph_lines))
-                current_paragraph_lines = []
+    # Read the markdown one line at a time rather than loading and splitting the whole file
+    with open(markdown_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            # Split off the leading marker once and look it up, instead of testing every prefix
+            first, sep, rest = line.partition(" ")
+            marker = first + sep
+            level = HEADING_LEVELS.get(marker)
+            if level is not None: # Title / section / sub-section heading
+                flush_paragraph()
+                document.add_heading(rest.strip(), level=level)
+            elif first.startswith(CODE_FENCE): # Code block start/end
+                flush_paragraph()
+                in_code_block = not in_code_block
+                if not in_code_block: # End of code block
+                    document.add_paragraph("") # Add an empty paragraph after code block
+            elif in_code_block:
+                document.add_paragraph(line)
+            elif marker == LIST_MARKER and rest.startswith("  "): # List item ("*   ")
+                flush_paragraph()
+                document.add_paragraph("- " + rest[2:], style="List Bullet")
+            elif first.startswith(IMAGE_PLACEHOLDER): # Image placeholder
+                flush_paragraph()
+                document.add_paragraph(line)
+            else:
+                stripped = line.strip()
+                if stripped == "---":
+                    flush_paragraph()
+                    document.add_paragraph("") # Add a separator or new paragraph
+                elif stripped: # Regular paragraph line
+                    if paragraph.tell():
+                        paragraph.write(" ")
+                    paragraph.write(stripped)
+                else: # Empty line, end of paragraph
+                    flush_paragraph()
 
     # Add any remaining paragraph lines
-    if current_paragraph_lines:
-        document.add_paragraph(" ".join(current_paragraph_lines))
+    flush_paragraph()
 
     document.save(output_file)
 
@@ -1,79 +1,637 @@
 # -*- coding: utf-8 -*-
 import logging
 import codecs
-from os.path import abspath, relpath
-from os import scandir
-from dataclasses import dataclass
+import fnmatch
+import os
+import pickle
+import platform
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice, repeat
+from os.path import abspath, realpath, relpath
+from os import cpu_count, scandir
+from dataclasses import dataclass, field
+from functools import lru_cache
+from importlib.util import find_spec
 import argparse
-from typing import List, Tuple
-
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.lib.enums import TA_CENTER
-
-try:
-    from docx import Document
-    from docx.shared import Pt, Inches
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    DOCX_AVAILABLE = True
-except ImportError:
-    DOCX_AVAILABLE = False
+from typing import List, Optional, Tuple
+
+# python-docx 是可选依赖，这里只查找不导入
+DOCX_AVAILABLE = find_spec('docx') is not None
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_INDIRS = ['.']
 DEFAULT_EXTS = ['c', 'h', 'py', 'js', 'java', 'cpp', 'hpp']
 DEFAULT_COMMENT_CHARS = ['/*', '*', '*/', '//', '#']
+# 扫描目录、读取文件主要在等待 I/O，线程数可以多于 CPU 核数；
+# 编码检测和解码则占用 CPU，受 GIL 限制，需要时可用 --jobs 改为多进程
+DEFAULT_MAX_WORKERS = min(32, (cpu_count() or 1) * 4)
+# 检测编码只需文件开头的一段样本，不必读入整个文件
+ENCODING_SAMPLE_SIZE = 32768
+# 文件排序方式：none 保持遍历顺序（最快），name 按文件名（不区分大小写），path 按完整路径
+SORT_CHOICES = ('none', 'name', 'path')
+# 超过该长度的代码行会被拆分为多行
+MAX_CHARS_PER_LINE = 90
+# 中文字符（CJK 统一汉字）
+_CJK_RE = re.compile('[\u4e00-\u9fff]')
+
+def as_prefix_tuple(prefixes):
+    """把单个字符串或列表统一为元组，str.startswith 可一次匹配元组中的所有前缀"""
+    if not prefixes:
+        return ()
+    if isinstance(prefixes, str):
+        return (prefixes,)
+    return tuple(prefixes)
+
+def compile_comment_matcher(comment_chars):
+    """把所有注释前缀编译为一个正则，允许前导空白，返回其 match 方法
+
+    写入器创建时编译一次，读取文件时用它逐行判断注释行，每行只需一次 C 层匹配
+    """
+    pattern = r'\s*(?:' + '|'.join(re.escape(c) for c in comment_chars) + ')'
+    return re.compile(pattern).match
 
-def del_slash(dirs):
-    return [dir_[:-1] if dir_[-1] == '/' else dir_ for dir_ in dirs]
+def as_dir_prefixes(paths):
+    """给路径补上结尾的分隔符，作为其子路径的前缀，避免 /a/sk 误匹配 /a/skip"""
+    return tuple(path if path.endswith(os.sep) else path + os.sep for path in paths)
+
+def is_glob_pattern(path):
+    """路径中含有 fnmatch 通配符时视为匹配模式"""
+    return any(c in path for c in '*?[')
 
 class CodeFinder(object):
-    def __init__(self, exts=None):
+    def __init__(self, exts=None, workers=1, exclude_patterns=None):
         self.exts = exts if exts else DEFAULT_EXTS
+        # 并发扫描目录的线程数，为 1 时在当前线程中逐个扫描
+        self.workers = max(1, workers)
+        # 通配符排除模式：不含路径分隔符的匹配文件或目录名，绝对路径模式匹配完整路径，
+        # 其余相对路径模式匹配相对于输入目录的路径；同类模式合并为一个正则，每项只需一次 C 层匹配
+        exclude_patterns = [os.path.normpath(p) for p in exclude_patterns] if exclude_patterns else []
+        name_patterns = [p for p in exclude_patterns if os.sep not in p and '/' not in p]
+        self._path_patterns = [p for p in exclude_patterns if p not in name_patterns]
+        self._exclude_name_match = (
+            re.compile('|'.join(fnmatch.translate(p) for p in name_patterns)).match
+            if name_patterns else None
+        )
+        # 后缀带上点号，避免 'foopy' 被当成 py 文件；str.endswith 接受元组，一次 C 调用即可匹配所有后缀
+        self._ext_suffixes = tuple('.' + ext.lstrip('.') for ext in self.exts)
 
-    @staticmethod
-    def is_hidden_file(file):
-        return file[0] == '.'
+    def is_code(self, file):
+        return file.endswith(self._ext_suffixes)
 
-    @staticmethod
-    def should_be_excluded(file, excludes = None):
-        if not excludes:
-            return False
-        if not isinstance(excludes, list):
-            excludes = [excludes]
-        return any(file.startswith(exclude) for exclude in excludes)
+    def _compile_path_patterns(self, root):
+        """把路径类排除模式编译为匹配 root 下完整路径的正则，返回其 match 方法"""
+        if not self._path_patterns:
+            return None
+        root_prefix = re.escape(as_dir_prefixes([root])[0])
+        return re.compile('|'.join(
+            fnmatch.translate(p) if os.path.isabs(p) else root_prefix + fnmatch.translate(p)
+            for p in self._path_patterns
+        )).match
 
-    def is_code(self, file):
-        is_code_file = any(file.endswith(ext) for ext in self.exts)
-        return is_code_file
+    def _scan_dir(self, current_dir, exclude_set, exclude_prefixes, exclude_path_match, with_mtimes):
+        """扫描单个目录
 
-    def find(self, indir, excludes = None):
-        files = []
-        for entry in scandir(indir):
-            entry_name = entry.name
-            entry_path = abspath(entry.path)
-            if self.is_hidden_file(entry_name) or self.should_be_excluded(entry_path, excludes):
-                continue
-            if entry.is_file():
-                if self.is_code(entry_name):
-                    files.append(entry_path)
+        返回 (entries, subdir_mtimes)：entries 按目录项顺序列出代码文件和子目录的 (路径, 是否为目录)，
+        subdir_mtimes 为子目录的 (路径, st_mtime_ns)
+        """
+        entries = []
+        subdir_mtimes = []
+        found = 0
+        exclude_name_match = self._exclude_name_match
+        with scandir(current_dir) as it:
+            for entry in it:
+                if entry.name[0] == '.':
+                    continue
+                if exclude_set and (entry.path in exclude_set or entry.path.startswith(exclude_prefixes)):
+                    continue
+                if exclude_name_match and exclude_name_match(entry.name):
+                    continue
+                if exclude_path_match and exclude_path_match(entry.path):
+                    continue
+                # 文件类型直接取自 readdir 结果，无需额外 stat
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append((entry.path, True))
+                    # 在扫描该目录之前记录 mtime，扫描期间的改动下次也能发现
+                    if with_mtimes:
+                        subdir_mtimes.append((entry.path, entry.stat(follow_symlinks=False).st_mtime_ns))
+                elif self.is_code(entry.name) and entry.is_file():
+                    entries.append((entry.path, False))
+                    found += 1
+        logger.debug('%s directory:%d code files.', current_dir, found)
+        return entries, subdir_mtimes
+
+    def _exclude_rules(self, root, excludes):
+        """整理排除规则，返回 _scan_dir 所需的 (exclude_set, exclude_prefixes, exclude_path_match)"""
+        # 排除项本身用集合精确匹配，其子路径用元组做前缀匹配
+        excludes = as_prefix_tuple(excludes)
+        return frozenset(excludes), as_dir_prefixes(excludes), self._compile_path_patterns(root)
+
+    def find(self, indir, excludes = None, dir_states = None):
+        """遍历目录查找代码文件，按深度优先顺序产出代码文件的绝对路径
+
+        为了并发扫描，整个目录树扫描完成后才开始产出第一个路径，调用方无法提前开始处理或中途停止扫描。
+        传入列表 dir_states 时，会把遍历到的每个目录的 (路径, st_mtime_ns, 扫描结果) 追加进去，
+        用于判断文件列表缓存是否过期，见 is_unchanged
+        """
+        # 根目录取一次绝对路径，scandir 返回的 entry.path 随之均为绝对路径；排除规则也只在入口处统一一次
+        root = abspath(indir)
+        exclude_set, exclude_prefixes, exclude_path_match = self._exclude_rules(root, excludes)
+        with_mtimes = dir_states is not None
+        dir_mtimes = {root: os.stat(root).st_mtime_ns} if with_mtimes else None
+        
+        # 按层扫描：同一层的目录互不依赖，交给线程池并发扫描，各目录的扫描结果先按路径保存
+        scanned = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        scan_map = executor.map if executor else map
+        try:
+            level = [root]
+            while level:
+                results = scan_map(self._scan_dir, level, repeat(exclude_set), repeat(exclude_prefixes),
+                                   repeat(exclude_path_match), repeat(with_mtimes))
+                next_level = []
+                for current_dir, (entries, subdir_mtimes) in zip(level, results):
+                    scanned[current_dir] = entries
+                    next_level.extend(path for path, is_dir in entries if is_dir)
+                    if with_mtimes:
+                        dir_mtimes.update(subdir_mtimes)
+                level = next_level
+        finally:
+            if executor:
+                executor.shutdown()
+        
+        if with_mtimes:
+            dir_states.extend((path, dir_mtimes[path], entries) for path, entries in scanned.items())
+        
+        # 再按目录项顺序深度优先拼接：遇到子目录时先产出它的全部内容，
+        # 同一目录下的文件保持相邻，顺序与逐层递归遍历完全相同
+        stack = [iter(scanned.pop(root))]
+        while stack:
+            for path, is_dir in stack[-1]:
+                if is_dir:
+                    stack.append(iter(scanned.pop(path)))
+                    break
+                yield path
             else:
-                files.extend(self.find(entry_path, excludes=excludes))
-        logger.debug('%s directory:%d code files.', indir, len(files))
-        return files
+                stack.pop()
 
-class PDFCodeWriter(object):
-    def __init__(self, font_name='Courier', font_size=7, max_front_pages=30, max_back_pages=30):
-        self.font_name = font_name
-        self.font_size = font_size
+    def is_unchanged(self, indir, excludes, dir_states):
+        """判断 find 记录下的 dir_states 是否仍与 indir 下的目录一致
+
+        mtime 未变的目录直接视为未改动，只需一次 stat；mtime 变了的目录重新扫描一次，
+        代码文件和子目录与上次完全相同时仍视为未改动。这样在目录下写入 PDF、缓存等非代码文件
+        （包括本工具自己的输出）不会让缓存失效
+        """
+        root = abspath(indir)
+        exclude_set, exclude_prefixes, exclude_path_match = self._exclude_rules(root, excludes)
+        for path, mtime, entries in dir_states:
+            if os.stat(path).st_mtime_ns == mtime:
+                continue
+            current, _ = self._scan_dir(path, exclude_set, exclude_prefixes, exclude_path_match, False)
+            if current != entries:
+                return False
+        return True
+
+# 文件列表缓存的格式版本，格式变化时递增，旧缓存随之失效
+FILE_LIST_CACHE_VERSION = 2
+
+def load_file_list_cache(cache_path, key, finder, excludes):
+    """读取文件列表缓存
+
+    缓存不存在、查找参数不同，或任一遍历过的目录中的代码文件、子目录有变化时返回 None；
+    dir_states 按输入目录记录 find 的结果，由 finder.is_unchanged 逐个比对
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            version, cached_key, dir_states, files = pickle.load(f)
+    except Exception:
+        return None
+    if version != FILE_LIST_CACHE_VERSION or cached_key != key:
+        return None
+    # 目录下增删、重命名文件或子目录都会改变该目录的 mtime，通常只需 stat 遍历过的目录，无需 stat 每个文件
+    try:
+        for indir, states in dir_states:
+            if not finder.is_unchanged(indir, excludes, states):
+                return None
+    except OSError:
+        return None
+    return files
+
+def save_file_list_cache(cache_path, key, dir_states, files):
+    """保存文件列表缓存，先写临时文件再替换，中途出错不会留下损坏的缓存
+
+    缓存是可选的，写入失败（目录不存在、没有写权限等）只记录警告，不影响本次运行
+    """
+    tmp_path = cache_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((FILE_LIST_CACHE_VERSION, key, dir_states, files), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning('Could not write file list cache %s: %s', cache_path, e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+# chardet、reportlab、python-docx 导入较慢，推迟到真正生成文档时才导入，
+# 这样 --help 和参数错误可以立即返回；导入结果绑定为模块级名称，供其余代码直接使用
+@lru_cache(maxsize=None)
+def load_chardet():
+    """导入检测编码所需的 chardet，也用作读取文件的工作进程的初始化函数"""
+    import chardet
+    globals().update(chardet=chardet)
+
+@lru_cache(maxsize=None)
+def load_pdf_backend():
+    """导入生成 PDF 所需的模块"""
+    load_chardet()
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    globals().update(canvas=canvas, A4=A4, pdfmetrics=pdfmetrics, TTFont=TTFont)
+
+@lru_cache(maxsize=None)
+def load_docx_backend():
+    """导入生成 DOCX 所需的模块，返回 python-docx 是否可用"""
+    global DOCX_AVAILABLE
+    load_chardet()
+    try:
+        from docx import Document
+        from docx.shared import Pt, Inches
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        from docx.oxml.ns import qn
+    except ImportError:
+        DOCX_AVAILABLE = False
+        return False
+    globals().update(Document=Document, Pt=Pt, Inches=Inches, WD_ALIGN_PARAGRAPH=WD_ALIGN_PARAGRAPH, qn=qn)
+    DOCX_AVAILABLE = True
+    return True
+
+# 各系统按顺序尝试的中文字体
+CHINESE_FONT_CANDIDATES = {
+    # macOS：PingFang SC，其次 STHeiti
+    "Darwin": ['/System/Library/Fonts/PingFang.ttc', '/System/Library/Fonts/STHeiti Medium.ttc'],
+    "Windows": ['C:/Windows/Fonts/simhei.ttf', 'C:/Windows/Fonts/simsun.ttc'],
+}
+# Linux等其他系统
+DEFAULT_CHINESE_FONT_CANDIDATES = ['/usr/share/fonts/truetype/wqy/wqy-microhei.ttc']
+
+@lru_cache(maxsize=None)
+def detect_chinese_font():
+    """查找并注册中文字体，返回字体名
+
+    每个进程只探测一次，之后创建的 PDFCodeWriter 直接复用注册结果
+    """
+    try:
+        # 尝试使用系统中文字体
+        candidates = CHINESE_FONT_CANDIDATES.get(platform.system(), DEFAULT_CHINESE_FONT_CANDIDATES)
+        for font_path in candidates:
+            try:
+                pdfmetrics.registerFont(TTFont('Chinese', font_path))
+                return 'Chinese'
+            except:
+                continue
+        # 如果都失败，使用Helvetica，但中文会显示为方框
+        print("Warning: Chinese font not available, Chinese characters may not display correctly")
+    except Exception as e:
+        print(f"Font setup error: {e}")
+    return 'Helvetica'
+
+# 每页需要的有效行数（不计空白行）- 确保最终文档每页显示50行
+# 考虑到页眉占2行，实际内容区域需要更多行才能填满页面
+EFFECTIVE_LINES_PER_PAGE = 52  # 增加到52行以确保页面填满
+
+def paginate(line_iter, max_front_pages, max_back_pages, lines_per_page=EFFECTIVE_LINES_PER_PAGE):
+    """把 (line, is_effective, is_code) 流分成前页和后页，PDF 与 DOCX 共用
+
+    is_effective 为非空行，决定每页的行数；is_code 为计入有效代码行的行（PDF 不计注释行），
+    决定后页是否需要截取。前页边读边分页；其后的行只在一个与后页等大的窗口中保留。
+    返回 (front_pages, back_pages)，每页为行列表
+    """
+    # 前页在中途 break 后，后页要从同一位置接着读
+    line_iter = iter(line_iter)
+    
+    # 分页逻辑
+    front_pages = []
+    back_pages = []
+    
+    current_page_lines = []
+    current_effective_count = 0
+    page_count = 0
+    
+    if max_front_pages > 0:
+        for line, is_effective, _ in line_iter:
+            current_page_lines.append(line)
+            if is_effective:
+                current_effective_count += 1
+            
+            # 如果有效行数达到每页限制，完成当前页
+            if current_effective_count >= lines_per_page:
+                front_pages.append(current_page_lines)
+                logger.debug('Front page %d: %d total lines, %d effective lines', page_count + 1, len(current_page_lines), current_effective_count)
+                current_page_lines = []
+                current_effective_count = 0
+                page_count += 1
+                if page_count >= max_front_pages:
+                    break
+        
+        # 到达文件末尾时，不足一页的内容也作为一页
+        if current_page_lines:
+            front_pages.append(current_page_lines)
+            logger.debug('Front page %d: %d total lines, %d effective lines', page_count + 1, len(current_page_lines), current_effective_count)
+    
+    # 剩余的有效代码行超过后页容量时，后页只取最后 target_effective_lines 个非空行，否则剩余的行全部作为后页。
+    # 前页之后的行经过一个滑动窗口：一旦确定需要截取，只保留最后 target_effective_lines 个非空行
+    # （连同其间的空白行），更早的行读过即丢弃，内存占用与后页大小相当
+    target_effective_lines = max_back_pages * lines_per_page
+    tail = deque()
+    tail_effective_count = 0
+    remaining_code_count = 0
+    truncated = False
+    for item in line_iter:
+        tail.append(item)
+        if item[1]:
+            tail_effective_count += 1
+            if item[2]:
+                remaining_code_count += 1
+            if remaining_code_count > target_effective_lines:
+                while tail_effective_count > target_effective_lines:
+                    if tail.popleft()[1]:
+                        tail_effective_count -= 1
+                    truncated = True
+    
+    if truncated:
+        # 剩余行数超过后页容量时，后页从第一个保留的有效行开始
+        while tail and not tail[0][1]:
+            tail.popleft()
+    
+    if tail:
+        current_page_lines = []
+        current_effective_count = 0
+        back_page_num = 0
+        
+        for line, is_effective, _ in tail:
+            current_page_lines.append(line)
+            if is_effective:
+                current_effective_count += 1
+            
+            if current_effective_count >= lines_per_page:
+                back_pages.append(current_page_lines)
+                logger.debug('Back page %d: %d total lines, %d effective lines', back_page_num + 1, len(current_page_lines), current_effective_count)
+                current_page_lines = []
+                current_effective_count = 0
+                back_page_num += 1
+        
+        # 添加最后一页（如果有剩余内容）
+        if current_page_lines:
+            back_pages.append(current_page_lines)
+            logger.debug('Back page %d: %d total lines, %d effective lines', back_page_num + 1, len(current_page_lines), current_effective_count)
+    
+    return front_pages, back_pages
+
+class CodeWriter(object):
+    """PDF 与 DOCX 写入器共用的部分：读取文件、检测编码、拆分长行和分页"""
+    # 统计有效代码行（打印的总数、后页是否截取）时是否排除注释行
+    exclude_comment_lines = True
+
+    def __init__(self, max_front_pages=30, max_back_pages=30, comment_chars=None, sample_size=ENCODING_SAMPLE_SIZE,
+                 jobs=1):
         self.max_front_pages = max_front_pages
         self.max_back_pages = max_back_pages
+        self._comment_prefixes = tuple(comment_chars if comment_chars else DEFAULT_COMMENT_CHARS)
+        self._comment_match = compile_comment_matcher(self._comment_prefixes)
+        self._max_chars_per_line = MAX_CHARS_PER_LINE
+        # 检测编码时读取的字节数
+        self.sample_size = sample_size
+        # 读取文件的工作进程数，为 1 时在线程池中读取
+        self.jobs = jobs
+        # 待读取的代码行来源，分页时才按顺序流式读取，不再保存所有行
+        self._line_sources = []
+
+    @staticmethod
+    def is_blank_line(line):
+        # isspace 不会像 strip 那样复制出新字符串
+        return not line or line.isspace()
+
+    def is_comment_line(self, line, comment_chars=None):
+        comment_match = compile_comment_matcher(comment_chars) if comment_chars else self._comment_match
+        return comment_match(line) is not None
+
+    def wrap_long_line(self, line, max_chars=MAX_CHARS_PER_LINE):
+        """将长行拆分为多行"""
+        if len(line) <= max_chars:
+            return [line]
+        
+        # 按固定步长直接切片，每个字符只复制一次，不再反复截取剩余部分
+        return [line[i:i + max_chars] for i in range(0, len(line), max_chars)]
+
+    def check_file_encoding(self, file_path):
+        """ check file encoding """
+        with open(file_path, 'rb') as fd:
+            return self.detect_encoding(file_path, fd.read(self.sample_size))
+
+    def read_code_file(self, file_path):
+        """读取整个文件，并用开头的样本检测编码，返回 (encoding, raw_data)"""
+        with open(file_path, 'rb') as fd:
+            raw_data = fd.read()
+        return self.detect_encoding(file_path, raw_data[:self.sample_size]), raw_data
+
+    def detect_encoding(self, file_path, raw_data):
+        """根据字节样本检测编码"""
+        # 绝大多数源码文件是 UTF-8：带 BOM 或能按 UTF-8 解码的样本直接返回，
+        # 不必运行 chardet 的统计分析
+        if raw_data.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        try:
+            # 样本末尾可能截断多字节字符，增量解码器会忽略残缺的尾部
+            codecs.getincrementaldecoder('utf-8')().decode(raw_data)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        
+        result = chardet.detect(raw_data)
+        encode_str = result['encoding']
+        confidence = result['confidence']
+        logger.debug("input_file: %s, encoding: %s, confidence: %f", file_path, encode_str, confidence)
+        
+        # 如果置信度太低，尝试常见编码
+        if confidence < 0.7:
+            # UTF-8 已在上面排除
+            for encoding in ['gbk', 'gb2312', 'big5']:
+                try:
+                    codecs.getincrementaldecoder(encoding)().decode(raw_data)
+                    encode_str = encoding
+                    break
+                except:
+                    continue
+        
+        return encode_str
+
+    def decode_code(self, file_path, raw_data, encoding):
+        """解码整个文件，返回 (encoding, text)
+
+        encoding 只是根据开头的样本检测出来的，样本之后仍可能出现别的编码的字节，
+        例如开头 32 KiB 全是 ASCII 的 GBK 文件会被判断为 UTF-8。因此先严格解码整个文件，
+        失败时改用整个文件重新检测编码，仍然失败才用替换字符代替无法解码的字节
+        """
+        try:
+            return encoding, raw_data.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            pass
+        full_encoding = self.detect_encoding(file_path, raw_data)
+        if full_encoding and full_encoding != encoding:
+            logger.debug("input_file: %s, sample encoding %s does not fit the whole file, using %s",
+                         file_path, encoding, full_encoding)
+            encoding = full_encoding
+        try:
+            return encoding, raw_data.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            return encoding, raw_data.decode(encoding, errors='replace')
+
+    def __getstate__(self):
+        # 多进程读取时写入器会被序列化发给工作进程，待读取的生成器无法也无需传过去
+        state = self.__dict__.copy()
+        state['_line_sources'] = []
+        return state
+
+    def _read_one(self, file, base_dir=None):
+        """读取并处理单个文件，在线程池的工作线程中执行，指定 --jobs 时在工作进程中执行
+
+        返回 (encoding, lines, effective, code, error)：lines 以文件路径注释行开头，
+        effective（非空行）和 code（非空且不是注释的行）与 lines 一一对应，error 为解码失败时的异常
+        """
+        encoding, raw_data = self.read_code_file(file)
+        
+        # 添加文件相对路径注释
+        if base_dir:
+            try:
+                relative_path = relpath(file, base_dir)
+            except ValueError:
+                relative_path = file
+        else:
+            relative_path = file
+        
+        # 不排除注释行时，有效代码行就是非空行
+        comment_match = self._comment_match if self.exclude_comment_lines else None
+        
+        # 添加文件路径注释行
+        header = f"# File: {relative_path}"
+        lines = [header]
+        effective = [True]
+        code = [comment_match is None or comment_match(header) is None]
+        error = None
+        
+        # 一次性解码整个文件再按行拆分，读入时顺便标记有效行和注释行，分页时无需再扫描
+        max_chars = self._max_chars_per_line
+        try:
+            encoding, text = self.decode_code(file, raw_data, encoding)
+            for line in text.splitlines():
+                line = line.rstrip()
+                # 绝大多数行不需要换行，直接追加；只有长行才拆分
+                if len(line) <= max_chars:
+                    lines.append(line)
+                    # 已去掉行尾空白，非空即为有效行
+                    is_effective = bool(line)
+                    effective.append(is_effective)
+                    code.append(is_effective and (comment_match is None or comment_match(line) is None))
+                else:
+                    for wrapped_line in self.wrap_long_line(line, max_chars=max_chars):
+                        lines.append(wrapped_line)
+                        is_effective = not self.is_blank_line(wrapped_line)
+                        effective.append(is_effective)
+                        code.append(is_effective and (comment_match is None or comment_match(wrapped_line) is None))
+        except Exception as e:
+            error = e
+            message = f"# Error reading file: {e}"
+            lines.append(message)
+            effective.append(True)
+            code.append(comment_match is None or comment_match(message) is None)
+        return encoding, lines, effective, code, error
+
+    def _read_batch(self, files, base_dir=None):
+        """依次读取一批文件，返回各文件 _read_one 的结果列表"""
+        return [self._read_one(file, base_dir) for file in files]
+
+    def _iter_file_lines(self, files, base_dir=None):
+        """按文件顺序产出每个文件的 (lines, effective, code)
+
+        读取、解码、拆行都在线程池（jobs > 1 时为进程池）中完成，按提交顺序取回结果，保证输出顺序确定
+        """
+        # 线程适合以读文件为主的情况；chardet 检测和解码占用 CPU，指定多个进程时可以绕开 GIL 用上多个核，
+        # 工作进程各自导入 chardet；进程池每次提交一批文件，减少进程间通信次数
+        if self.jobs > 1:
+            workers = self.jobs
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=load_chardet)
+            batch_size = 16
+        else:
+            workers = DEFAULT_MAX_WORKERS
+            executor = ThreadPoolExecutor(max_workers=workers)
+            batch_size = 1
+        file_iter = iter(files)
+        batches = iter(lambda: list(islice(file_iter, batch_size)), [])
+        with executor:
+            # 工作线程读得比分页快，一次提交所有文件会让读完的文件全部堆在内存中；
+            # 这里最多保留 2 * workers 批未取走的结果，每取走一批再提交下一批
+            pending = deque()
+            for batch in islice(batches, 2 * workers):
+                pending.append((batch, executor.submit(self._read_batch, batch, base_dir)))
+            while pending:
+                batch, future = pending.popleft()
+                results = future.result()
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    pending.append((next_batch, executor.submit(self._read_batch, next_batch, base_dir)))
+                for file, (encoding, lines, effective, code, error) in zip(batch, results):
+                    logger.debug('Processing: %s, encoding: %s', file, encoding)
+                    if error is not None:
+                        logger.warning('Error reading file %s: %s', file, error)
+                    yield lines, effective, code
+
+    def collect_code_lines(self, files, comment_chars, base_dir=None):
+        """收集所有代码行
+
+        这里只登记文件，代码行在 split_lines_for_pages 中边读边分页
+        """
+        self._line_sources.append(self._iter_file_lines(files, base_dir))
+
+    def split_lines_for_pages(self, comment_chars):
+        """将代码行分组为页面，确保每页至少50行有效代码
+
+        代码行从 collect_code_lines 登记的文件中流式读取，由 paginate 分页。
+        返回 (front_pages, back_pages)，每页为行列表
+        """
+        total_lines = 0
+        total_effective_lines = 0
+        
+        def iter_lines():
+            # 逐个文件展开为 (line, is_effective, is_code)，顺便统计总数
+            nonlocal total_lines, total_effective_lines
+            for source in self._line_sources:
+                for lines, effective, code in source:
+                    total_lines += len(lines)
+                    total_effective_lines += sum(code)
+                    yield from zip(lines, effective, code)
+            self._line_sources = []
+        
+        front_pages, back_pages = paginate(iter_lines(), self.max_front_pages, self.max_back_pages)
+        
+        print(f"Total lines collected: {total_lines}")
+        print(f"Total effective lines: {total_effective_lines}")
+        
+        return front_pages, back_pages
+
+class PDFCodeWriter(CodeWriter):
+    def __init__(self, font_name='Courier', font_size=7, max_front_pages=30, max_back_pages=30, comment_chars=None,
+                 sample_size=ENCODING_SAMPLE_SIZE, jobs=1):
+        load_pdf_backend()
+        super().__init__(max_front_pages=max_front_pages, max_back_pages=max_back_pages, comment_chars=comment_chars,
+                         sample_size=sample_size, jobs=jobs)
+        self.font_name = font_name
+        self.font_size = font_size
         self.line_height = font_size + 1
         self.margin_left = 40
         self.margin_right = 40
@@ -84,282 +642,79 @@ class PDFCodeWriter(object):
         self.usable_width = self.page_width - self.margin_left - self.margin_right
         self.usable_height = self.page_height - self.margin_top - self.margin_bottom
         self.lines_per_page = int(self.usable_height / self.line_height)
+        # 从 margin_top 往下逐行绘制，直到低于 margin_bottom 为止，可绘制的行数是固定的
+        self._max_drawable_lines = self.lines_per_page + 1
         
-        # 存储所有内容行
-        self.all_lines = []
         self.canvas = None
+        # 页眉文字每页都相同，记住上次的文字及其字体，避免每页重复检测
+        self._header_text = None
+        self._header_font = None
         
         # 注册中文字体
         self.setup_fonts()
         
     def setup_fonts(self):
         """设置字体，支持中文"""
-        try:
-            # 尝试使用系统中文字体
-            import platform
-            system = platform.system()
-            
-            if system == "Darwin":  # macOS
-                try:
-                    # 尝试使用 PingFang SC
-                    pdfmetrics.registerFont(TTFont('Chinese', '/System/Library/Fonts/PingFang.ttc'))
-                    self.chinese_font = 'Chinese'
-                except:
-                    try:
-                        # 尝试使用 STHeiti
-                        pdfmetrics.registerFont(TTFont('Chinese', '/System/Library/Fonts/STHeiti Medium.ttc'))
-                        self.chinese_font = 'Chinese'
-                    except:
-                        # 如果都失败，使用Helvetica，但中文会显示为方框
-                        self.chinese_font = 'Helvetica'
-                        print("Warning: Chinese font not available, Chinese characters may not display correctly")
-            elif system == "Windows":
-                try:
-                    # Windows 中文字体
-                    pdfmetrics.registerFont(TTFont('Chinese', 'C:/Windows/Fonts/simhei.ttf'))
-                    self.chinese_font = 'Chinese'
-                except:
-                    try:
-                        pdfmetrics.registerFont(TTFont('Chinese', 'C:/Windows/Fonts/simsun.ttc'))
-                        self.chinese_font = 'Chinese'
-                    except:
-                        self.chinese_font = 'Helvetica'
-                        print("Warning: Chinese font not available, Chinese characters may not display correctly")
-            else:
-                # Linux等其他系统
-                try:
-                    pdfmetrics.registerFont(TTFont('Chinese', '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc'))
-                    self.chinese_font = 'Chinese'
-                except:
-                    self.chinese_font = 'Helvetica'
-                    print("Warning: Chinese font not available, Chinese characters may not display correctly")
-        except Exception as e:
-            print(f"Font setup error: {e}")
-            self.chinese_font = 'Helvetica'
+        self.chinese_font = detect_chinese_font()
+
+    def __getstate__(self):
+        # 画布同样无需传给工作进程
+        state = super().__getstate__()
+        state['canvas'] = None
+        return state
 
     def contains_chinese(self, text):
         """检查文本是否包含中文字符"""
-        for char in text:
-            if '\u4e00' <= char <= '\u9fff':
-                return True
-        return False
-        
-    def check_file_encoding(self, file_path):
-        """ check file encoding """
-        import chardet
-        with open(file_path, 'rb') as fd:
-            raw_data = fd.read()
-            result = chardet.detect(raw_data)
-            encode_str = result['encoding']
-            confidence = result['confidence']
-            logging.info("input_file: %s, encoding: %s, confidence: %f", file_path, encode_str, confidence)
-            
-            # 如果置信度太低，尝试常见编码
-            if confidence < 0.7:
-                for encoding in ['utf-8', 'gbk', 'gb2312', 'big5']:
-                    try:
-                        raw_data.decode(encoding)
-                        encode_str = encoding
-                        break
-                    except:
-                        continue
-            
-            return encode_str
-
-    @staticmethod
-    def is_blank_line(line):
-        return not bool(line.strip())
-
-    def is_comment_line(self, line, comment_chars):
-        return any(line.lstrip().startswith(comment_char) for comment_char in comment_chars)
-    
-    def wrap_long_line(self, line, max_chars=90):
-        """将长行拆分为多行"""
-        if len(line) <= max_chars:
-            return [line]
+        # str.isascii() 只检查字符串内部的标志位，是 O(1) 的，纯 ASCII 文本无需再跑正则
+        return not text.isascii() and _CJK_RE.search(text) is not None
         
-        wrapped_lines = []
-        while len(line) > max_chars:
-            wrapped_lines.append(line[:max_chars])
-            line = line[max_chars:]
-        if line:
-            wrapped_lines.append(line)
-        return wrapped_lines
-
-    def collect_code_lines(self, files, comment_chars, base_dir=None):
-        """收集所有代码行"""
-        for file in files:
-            encoding = self.check_file_encoding(file)
-            print(f"Processing: {file}, encoding: {encoding}")
-            
-            # 添加文件相对路径注释
-            if base_dir:
-                try:
-                    relative_path = relpath(file, base_dir)
-                except ValueError:
-                    relative_path = file
-            else:
-                relative_path = file
-            
-            # 添加文件路径注释行
-            self.all_lines.append(f"# File: {relative_path}")
-            
-            # 读取文件内容
-            try:
-                with codecs.open(file, 'r', encoding, errors='replace') as fp:
-                    for line in fp:
-                        line = line.rstrip()
-                        # 处理长行换行
-                        wrapped_lines = self.wrap_long_line(line, max_chars=90)
-                        self.all_lines.extend(wrapped_lines)
-            except Exception as e:
-                print(f"Error reading file {file}: {e}")
-                self.all_lines.append(f"# Error reading file: {e}")
-        
-        print(f"Total lines collected: {len(self.all_lines)}")
-
     def count_effective_lines(self, lines, comment_chars):
         """计算有效行数（非空非注释行）"""
+        comment_match = compile_comment_matcher(comment_chars) if comment_chars else self._comment_match
+        is_blank_line = self.is_blank_line
         count = 0
         for line in lines:
-            if not self.is_blank_line(line) and not self.is_comment_line(line, comment_chars):
+            if not is_blank_line(line) and comment_match(line) is None:
                 count += 1
         return count
 
-    def split_lines_for_pages(self, comment_chars):
-        """将代码行分组为页面，确保每页至少50行有效代码"""
-        if not self.all_lines:
-            return [], []
-        
-        # 计算总的有效行数
-        total_effective_lines = self.count_effective_lines(self.all_lines, comment_chars)
-        print(f"Total effective lines: {total_effective_lines}")
-        
-        # 每页需要的有效行数（不计空白行）- 确保最终文档每页显示50行
-        # 考虑到页眉占2行，实际内容区域需要更多行才能填满页面
-        lines_per_page = 52  # 增加到52行以确保页面填满
-        
-        # 分页逻辑
-        front_pages = []
-        back_pages = []
-        
-        current_page_lines = []
-        current_effective_count = 0
-        page_count = 0
-        
-        i = 0
-        while i < len(self.all_lines) and page_count < self.max_front_pages:
-            line = self.all_lines[i]
-            current_page_lines.append(line)
-            
-            # 检查是否为有效行（非空白行）
-            if not self.is_blank_line(line):
-                current_effective_count += 1
-            
-            # 如果有效行数达到每页限制，或者到达文件末尾，完成当前页
-            if current_effective_count >= lines_per_page or i == len(self.all_lines) - 1:
-                front_pages.append(current_page_lines.copy())
-                print(f"Front page {page_count + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-                current_page_lines = []
-                current_effective_count = 0
-                page_count += 1
-            
-            i += 1
-        
-        # 如果前面没有用完所有行，需要处理后面的页面
-        if i < len(self.all_lines):
-            # 找到最后30页的开始位置
-            remaining_lines = self.all_lines[i:]
-            remaining_effective = self.count_effective_lines(remaining_lines, comment_chars)
-            
-            if remaining_effective > self.max_back_pages * lines_per_page:
-                # 找到最后30页的开始位置
-                target_effective_lines = self.max_back_pages * lines_per_page
-                start_pos = len(remaining_lines) - 1
-                effective_count = 0
-                
-                # 从后往前计算
-                for j in range(len(remaining_lines) - 1, -1, -1):
-                    line = remaining_lines[j]
-                    if not self.is_blank_line(line):
-                        effective_count += 1
-                    
-                    if effective_count >= target_effective_lines:
-                        start_pos = j
-                        break
+    def create_pdf(self, filename, title, version, front_pages, back_pages):
+        """创建PDF文件"""
+        # 写入同目录下的临时文件后再替换目标文件，中途失败不会留下不完整的 PDF；
+        # 1 MiB 缓冲把 reportlab 的零碎写入合并成少量系统调用
+        tmp_filename = filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb', buffering=1 << 20) as fp:
+                self.canvas = canvas.Canvas(fp, pagesize=A4)
                 
-                # 从找到的位置开始分页
-                back_lines = remaining_lines[start_pos:]
-                current_page_lines = []
-                current_effective_count = 0
-                back_page_num = 0
+                # 写入前面的页面
+                for page_num, page_lines in enumerate(front_pages, 1):
+                    self.draw_page(page_lines, page_num, title, version)
+                    self.canvas.showPage()
                 
-                for line in back_lines:
-                    current_page_lines.append(line)
-                    
-                    if not self.is_blank_line(line):
-                        current_effective_count += 1
+                # 如果有后面的页面，添加省略页
+                if back_pages:
+                    self.draw_ellipsis_page(len(front_pages) + 1, title, version)
+                    self.canvas.showPage()
                     
-                    if current_effective_count >= lines_per_page:
-                        back_pages.append(current_page_lines.copy())
-                        print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-                        current_page_lines = []
-                        current_effective_count = 0
-                        back_page_num += 1
+                    # 写入后面的页面
+                    for page_num, page_lines in enumerate(back_pages, len(front_pages) + 2):
+                        self.draw_page(page_lines, page_num, title, version)
+                        self.canvas.showPage()
                 
-                # 添加最后一页（如果有剩余内容）
-                if current_page_lines:
-                    back_pages.append(current_page_lines)
-                    print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-            else:
-                # 剩余行数不足30页，全部作为后页
-                current_page_lines = []
-                current_effective_count = 0
-                back_page_num = 0
-                
-                for line in remaining_lines:
-                    current_page_lines.append(line)
-                    
-                    if not self.is_blank_line(line):
-                        current_effective_count += 1
-                    
-                    if current_effective_count >= lines_per_page:
-                        back_pages.append(current_page_lines.copy())
-                        print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-                        current_page_lines = []
-                        current_effective_count = 0
-                        back_page_num += 1
-                
-                if current_page_lines:
-                    back_pages.append(current_page_lines)
-                    print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-        
-        return front_pages, back_pages
-
-    def create_pdf(self, filename, title, version, front_pages, back_pages):
-        """创建PDF文件"""
-        self.canvas = canvas.Canvas(filename, pagesize=A4)
-        
-        # 写入前面的页面
-        for page_num, page_lines in enumerate(front_pages, 1):
-            self.draw_page(page_lines, page_num, title, version)
-            self.canvas.showPage()
-        
-        # 如果有后面的页面，添加省略页
-        if back_pages:
-            self.draw_ellipsis_page(len(front_pages) + 1, title, version)
-            self.canvas.showPage()
-            
-            # 写入后面的页面
-            for page_num, page_lines in enumerate(back_pages, len(front_pages) + 2):
-                self.draw_page(page_lines, page_num, title, version)
-                self.canvas.showPage()
-        
-        self.canvas.save()
+                self.canvas.save()
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        os.replace(tmp_filename, filename)
 
     def draw_header(self, page_num, title, version):
         """绘制页眉"""
+        canvas = self.canvas
+        code_font = self.font_name
         header_y = self.page_height - 30
+        right_x = self.page_width - self.margin_right
         
         # 左侧装订线留白（额外留出20点）
         header_left_margin = self.margin_left + 20
@@ -367,46 +722,51 @@ class PDFCodeWriter(object):
         # 绘制软件名称和版本号（左侧）
         header_text = f"{title} {version}"
         
-        # 检查是否包含中文，选择合适的字体
-        if self.contains_chinese(header_text):
-            self.canvas.setFont(self.chinese_font, 10)
-        else:
-            self.canvas.setFont(self.font_name, 10)
+        # 检查是否包含中文，选择合适的字体；页眉文字不变时沿用上一页的结果
+        if header_text != self._header_text:
+            self._header_text = header_text
+            self._header_font = self.chinese_font if self.contains_chinese(header_text) else code_font
+        header_font = self._header_font
+        canvas.setFont(header_font, 10)
         
-        self.canvas.drawString(header_left_margin, header_y, header_text)
+        canvas.drawString(header_left_margin, header_y, header_text)
         
-        # 绘制页码（右侧）
+        # 绘制页码（右侧），字体与页眉相同时不重复设置
         page_text = f"{page_num}"
-        self.canvas.setFont(self.font_name, 10)
-        self.canvas.drawRightString(self.page_width - self.margin_right, header_y, page_text)
+        if header_font != code_font:
+            canvas.setFont(code_font, 10)
+        canvas.drawRightString(right_x, header_y, page_text)
         
         # 绘制页眉下划线
         line_y = header_y - 5
-        self.canvas.line(header_left_margin, line_y, self.page_width - self.margin_right, line_y)
+        canvas.line(header_left_margin, line_y, right_x, line_y)
 
     def draw_page(self, lines, page_num, title, version):
         """绘制一页内容"""
         # 绘制页眉
         self.draw_header(page_num, title, version)
         
-        # 代码内容的起始位置
-        y_position = self.page_height - self.margin_top
+        # 循环中用到的属性和方法先绑定到局部变量，避免每行重复查找
+        canvas = self.canvas
+        font_size = self.font_size
+        line_height = self.line_height
+        cjk_font = self.chinese_font
+        code_font = self.font_name
+        contains_chinese = self.contains_chinese
         
-        # 绘制代码行
-        for line in lines:
-            if y_position < self.margin_bottom:
-                break
-            
-            # 检查是否包含中文，选择合适的字体
-            if self.contains_chinese(line):
-                self.canvas.setFont(self.chinese_font, self.font_size)
-            else:
-                self.canvas.setFont(self.font_name, self.font_size)
-            
-            # 左侧装订线留白
-            x_position = self.margin_left + 20
-            self.canvas.drawString(x_position, y_position, line)
-            y_position -= self.line_height
+        # 整页代码放在同一个文本对象中，由行距（leading）逐行下移，
+        # 而不是每行单独 drawString；左侧额外留出装订线空白
+        text = canvas.beginText(self.margin_left + 20, self.page_height - self.margin_top)
+        text_line = text.textLine
+        current_font = None
+        for line in lines[:self._max_drawable_lines]:
+            # 检查是否包含中文，选择合适的字体；字体未变化时不重复设置
+            wanted_font = cjk_font if contains_chinese(line) else code_font
+            if wanted_font != current_font:
+                text.setFont(wanted_font, font_size, leading=line_height)
+                current_font = wanted_font
+            text_line(line)
+        canvas.drawText(text)
 
     def draw_ellipsis_page(self, page_num, title, version):
         """绘制省略页"""
@@ -422,84 +782,17 @@ class PDFCodeWriter(object):
         
         self.canvas.drawString(x_center, y_center, text)
 
-class DOCXCodeWriter(object):
+class DOCXCodeWriter(CodeWriter):
     """DOCX代码文档生成器"""
-    def __init__(self, max_front_pages=30, max_back_pages=30):
-        if not DOCX_AVAILABLE:
+    # DOCX 的有效行只看是否为空行，注释行同样计入
+    exclude_comment_lines = False
+
+    def __init__(self, max_front_pages=30, max_back_pages=30, comment_chars=None, sample_size=ENCODING_SAMPLE_SIZE,
+                 jobs=1):
+        if not load_docx_backend():
             raise ImportError("python-docx is not installed. Install it with: pip install python-docx")
-        
-        self.max_front_pages = max_front_pages
-        self.max_back_pages = max_back_pages
-        self.all_lines = []
-    
-    @staticmethod
-    def is_blank_line(line):
-        return not bool(line.strip())
-    
-    def is_comment_line(self, line, comment_chars):
-        return any(line.lstrip().startswith(comment_char) for comment_char in comment_chars)
-    
-    def wrap_long_line(self, line, max_chars=90):
-        """将长行拆分为多行"""
-        if len(line) <= max_chars:
-            return [line]
-        
-        wrapped_lines = []
-        while len(line) > max_chars:
-            wrapped_lines.append(line[:max_chars])
-            line = line[max_chars:]
-        if line:
-            wrapped_lines.append(line)
-        return wrapped_lines
-    
-    def check_file_encoding(self, file_path):
-        """检查文件编码"""
-        import chardet
-        with open(file_path, 'rb') as fd:
-            raw_data = fd.read()
-            result = chardet.detect(raw_data)
-            encode_str = result['encoding']
-            confidence = result['confidence']
-            logging.info("input_file: %s, encoding: %s, confidence: %f", file_path, encode_str, confidence)
-            
-            if confidence < 0.7:
-                for encoding in ['utf-8', 'gbk', 'gb2312', 'big5']:
-                    try:
-                        raw_data.decode(encoding)
-                        encode_str = encoding
-                        break
-                    except:
-                        continue
-            
-            return encode_str
-    
-    def collect_code_lines(self, files, comment_chars, base_dir=None):
-        """收集所有代码行"""
-        for file in files:
-            encoding = self.check_file_encoding(file)
-            print(f"Processing: {file}, encoding: {encoding}")
-            
-            if base_dir:
-                try:
-                    relative_path = relpath(file, base_dir)
-                except ValueError:
-                    relative_path = file
-            else:
-                relative_path = file
-            
-            self.all_lines.append(f"# File: {relative_path}")
-            
-            try:
-                with codecs.open(file, 'r', encoding, errors='replace') as fp:
-                    for line in fp:
-                        line = line.rstrip()
-                        wrapped_lines = self.wrap_long_line(line, max_chars=90)
-                        self.all_lines.extend(wrapped_lines)
-            except Exception as e:
-                print(f"Error reading file {file}: {e}")
-                self.all_lines.append(f"# Error reading file: {e}")
-        
-        print(f"Total lines collected: {len(self.all_lines)}")
+        super().__init__(max_front_pages=max_front_pages, max_back_pages=max_back_pages, comment_chars=comment_chars,
+                         sample_size=sample_size, jobs=jobs)
     
     def count_effective_lines(self, lines, comment_chars):
         """计算有效行数（非空行）"""
@@ -509,103 +802,6 @@ class DOCXCodeWriter(object):
                 count += 1
         return count
     
-    def split_lines_for_pages(self, comment_chars):
-        """将代码行分组为页面，确保每页至少50行有效代码"""
-        if not self.all_lines:
-            return [], []
-        
-        total_effective_lines = self.count_effective_lines(self.all_lines, comment_chars)
-        print(f"Total effective lines: {total_effective_lines}")
-        
-        lines_per_page = 52  # 增加到52行以确保页面填满
-        
-        front_pages = []
-        back_pages = []
-        
-        current_page_lines = []
-        current_effective_count = 0
-        page_count = 0
-        
-        i = 0
-        while i < len(self.all_lines) and page_count < self.max_front_pages:
-            line = self.all_lines[i]
-            current_page_lines.append(line)
-            
-            if not self.is_blank_line(line):
-                current_effective_count += 1
-            
-            if current_effective_count >= lines_per_page or i == len(self.all_lines) - 1:
-                front_pages.append(current_page_lines.copy())
-                print(f"Front page {page_count + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-                current_page_lines = []
-                current_effective_count = 0
-                page_count += 1
-            
-            i += 1
-        
-        if i < len(self.all_lines):
-            remaining_lines = self.all_lines[i:]
-            remaining_effective = self.count_effective_lines(remaining_lines, comment_chars)
-            
-            if remaining_effective > self.max_back_pages * lines_per_page:
-                target_effective_lines = self.max_back_pages * lines_per_page
-                start_pos = len(remaining_lines) - 1
-                effective_count = 0
-                
-                for j in range(len(remaining_lines) - 1, -1, -1):
-                    line = remaining_lines[j]
-                    if not self.is_blank_line(line):
-                        effective_count += 1
-                    
-                    if effective_count >= target_effective_lines:
-                        start_pos = j
-                        break
-                
-                back_lines = remaining_lines[start_pos:]
-                current_page_lines = []
-                current_effective_count = 0
-                back_page_num = 0
-                
-                for line in back_lines:
-                    current_page_lines.append(line)
-                    
-                    if not self.is_blank_line(line):
-                        current_effective_count += 1
-                    
-                    if current_effective_count >= lines_per_page:
-                        back_pages.append(current_page_lines.copy())
-                        print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-                        current_page_lines = []
-                        current_effective_count = 0
-                        back_page_num += 1
-                
-                if current_page_lines:
-                    back_pages.append(current_page_lines)
-                    print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-            else:
-                current_page_lines = []
-                current_effective_count = 0
-                back_page_num = 0
-                
-                for line in remaining_lines:
-                    current_page_lines.append(line)
-                    
-                    if not self.is_blank_line(line):
-                        current_effective_count += 1
-                    
-                    if current_effective_count >= lines_per_page:
-                        back_pages.append(current_page_lines.copy())
-                        print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-                        current_page_lines = []
-                        current_effective_count = 0
-                        back_page_num += 1
-                
-                if current_page_lines:
-                    back_pages.append(current_page_lines)
-                    print(f"Back page {back_page_num + 1}: {len(current_page_lines)} total lines, {current_effective_count} effective lines")
-        
-        return front_pages, back_pages
-    
     def create_docx(self, filename, title, version, front_pages, back_pages):
         """创建DOCX文件"""
         doc = Document()
@@ -638,9 +834,6 @@ class DOCXCodeWriter(object):
     
     def add_page_to_doc(self, doc, lines, page_num, title, version):
         """添加一页内容到文档"""
-        from docx.shared import RGBColor
-        from docx.oxml.ns import qn
-        
         # 添加页眉
         header = f"{title} {version}"
         p = doc.add_paragraph()
@@ -668,7 +861,7 @@ class DOCXCodeWriter(object):
         for line in lines:
             p = doc.add_paragraph()
             # 空行也要添加，但用空格占位
-            run = p.add_run(line if line.strip() else ' ')
+            run = p.add_run(' ' if self.is_blank_line(line) else line)
             run.font.name = 'Courier New'
             run.font.size = Pt(8)
             
@@ -702,20 +895,26 @@ class DOCXCodeWriter(object):
         p.alignment = WD_ALIGN_PARAGRAPH.CENTER
         run.font.size = Pt(24)
 
-@dataclass
+@dataclass(frozen=True)
 class MainParams:
-    title: str
-    version: str
-    indirs: list
-    exts: list
-    comment_chars: list
-    font_name: str
-    font_size: int
-    max_front_pages: int
-    max_back_pages: int
-    excludes: list
-    outfile: str
-    verbose: bool
+    """运行参数，默认值与命令行参数的默认值一致；创建后不可修改"""
+    title: str = '软件著作权申请材料'
+    version: str = 'V1.0'
+    indirs: list = field(default_factory=DEFAULT_INDIRS.copy)
+    exts: Optional[list] = None
+    comment_chars: Optional[list] = None
+    font_name: str = 'Courier'
+    font_size: int = 9
+    max_front_pages: int = 30
+    max_back_pages: int = 30
+    excludes: list = field(default_factory=list)
+    outfile: str = 'code.pdf'
+    verbose: bool = False
+    cache: Optional[str] = None
+    force_rescan: bool = False
+    scan_workers: int = DEFAULT_MAX_WORKERS
+    jobs: int = 1
+    sort: str = 'none'
 
 def main(main_params: MainParams):
     title = main_params.title
@@ -730,6 +929,11 @@ def main(main_params: MainParams):
     excludes = main_params.excludes
     outfile = main_params.outfile
     verbose = main_params.verbose
+    cache = main_params.cache
+    force_rescan = main_params.force_rescan
+    scan_workers = main_params.scan_workers
+    jobs = main_params.jobs
+    sort = main_params.sort
 
     if not indirs:
         indirs = DEFAULT_INDIRS
@@ -740,22 +944,62 @@ def main(main_params: MainParams):
     if verbose:
         logging.basicConfig(level=logging.DEBUG)
 
-    # 第零步，把所有的路径都转换为绝对路径
+    # 第零步，把所有的路径都转换为规范的绝对路径（解析符号链接、去掉结尾的斜杠），
+    # 之后的排除判断只需比较字符串；不存在或不是目录的输入路径直接跳过
     new_indirs = []
     for indir in indirs:
-        new_indirs.append(abspath(indir))
-    indirs = new_indirs
+        real_indir = realpath(indir)
+        if os.path.isdir(real_indir):
+            new_indirs.append(real_indir)
+        else:
+            logger.warning('Input directory %s does not exist or is not a directory, skipped', indir)
+    # 去掉重复的输入目录，以及位于其他输入目录之下的目录，避免同一批文件被遍历、输出两次
+    new_indirs = list(dict.fromkeys(new_indirs))
+    indirs = []
+    for indir in new_indirs:
+        parents = [other for other in new_indirs
+                   if other != indir and indir.startswith(as_dir_prefixes([other]))]
+        if parents:
+            logger.info('Input directory %s is inside %s, skipped', indir, parents[0])
+        else:
+            indirs.append(indir)
+    if not indirs:
+        print("Error: no usable input directory")
+        return 1
 
-    excludes = del_slash(
-        [abspath(exclude) for exclude in excludes] if excludes else []
-    )
+    # 含通配符的排除项按 fnmatch 规则匹配（* 可跨越目录，规则见 CodeFinder），保持原样；
+    # 其余排除项是路径，同样转换为规范的绝对路径后按路径前缀匹配
+    excludes = excludes if excludes else []
+    exclude_patterns = tuple(exclude for exclude in excludes if is_glob_pattern(exclude))
+    excludes = tuple(realpath(exclude) for exclude in excludes if not is_glob_pattern(exclude))
 
     # 第一步，查找代码文件
-    finder = CodeFinder(exts)
-    files = []
-    for indir in indirs:
-        for file in finder.find(indir, excludes = excludes):
-            files.append(file)
+    # 指定了缓存文件时，只要查找参数相同且遍历过的目录中的代码文件、子目录都没有变化，就直接复用上次的文件列表
+    cache_key = (tuple(indirs), tuple(sorted(exts)), tuple(sorted(excludes)), tuple(sorted(exclude_patterns)))
+    finder = CodeFinder(exts, workers=scan_workers, exclude_patterns=exclude_patterns)
+    files = None
+    if cache and not force_rescan:
+        files = load_file_list_cache(cache, cache_key, finder, excludes)
+        if files is not None:
+            print(f"Loaded file list from cache: {cache}")
+
+    if files is None:
+        # 每个输入目录内部按层并发扫描，目录之间依次进行，保证文件顺序确定
+        files = []
+        dir_states = []
+        for indir in indirs:
+            states = []
+            files.extend(finder.find(indir, excludes=excludes, dir_states=states))
+            dir_states.append((indir, states))
+
+        if cache:
+            save_file_list_cache(cache, cache_key, dir_states, files)
+    
+    # 只有要求排序时才排序；key 对每个文件只计算一次
+    if sort == 'name':
+        files.sort(key=lambda file: (os.path.basename(file).lower(), file))
+    elif sort == 'path':
+        files.sort()
     
     print(f"Found {len(files)} code files")
 
@@ -767,13 +1011,15 @@ def main(main_params: MainParams):
     
     if is_docx:
         # 第二步，生成DOCX
-        if not DOCX_AVAILABLE:
+        if not load_docx_backend():
             print("Error: python-docx is not installed. Install it with: pip install python-docx")
             return 1
         
         writer = DOCXCodeWriter(
             max_front_pages=max_front_pages,
-            max_back_pages=max_back_pages
+            max_back_pages=max_back_pages,
+            comment_chars=comment_chars,
+            jobs=jobs
         )
         
         # 收集所有代码行
@@ -795,7 +1041,9 @@ def main(main_params: MainParams):
             font_name=font_name,
             font_size=font_size,
             max_front_pages=max_front_pages,
-            max_back_pages=max_back_pages
+            max_back_pages=max_back_pages,
+            comment_chars=comment_chars,
+            jobs=jobs
         )
         
         # 收集所有代码行
@@ -820,36 +1068,32 @@ def parse_args():
     parser.add_argument('--version', type=str, default='V1.0', help='Version of the software')
     parser.add_argument('--indirs', type=str, nargs='+', default=['.'], help='Input directories')
     parser.add_argument('--exts', type=str, nargs='+', help='File extensions')
-    parser.add_argument('--comment_chars', type=str, nargs='+', help='Comment characters')
+    parser.add_argument('--comment_chars', type=str, nargs='+',
+                        help='Comment prefixes; lines starting with them are not counted as effective code lines '
+                             'in PDF output')
     parser.add_argument('--font_name', type=str, default='Courier', help='Font name')
     parser.add_argument('--font_size', type=int, default=9, help='Font size')
     parser.add_argument('--max_front_pages', type=int, default=30, help='Maximum front pages')
     parser.add_argument('--max_back_pages', type=int, default=30, help='Maximum back pages')
-    parser.add_argument('--excludes', type=str, nargs='+', default=[], help='Exclude directories/files')
+    parser.add_argument('--excludes', type=str, nargs='+', default=[],
+                        help='Exclude directories/files. Entries with * ? [ are fnmatch patterns: without "/" they '
+                             'match file or directory names (e.g. "*_test.py"), otherwise paths relative to each '
+                             'input directory (e.g. "*/generated/*") or absolute paths')
     parser.add_argument('--outfile', type=str, default='code.pdf', help='Output PDF file')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
+    parser.add_argument('--cache', type=str, default=None, help='Cache file for the list of code files')
+    parser.add_argument('--force_rescan', action='store_true', help='Ignore the cache and rescan input directories')
+    parser.add_argument('--scan_workers', type=int, default=DEFAULT_MAX_WORKERS, help='Number of threads scanning directories')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes reading source files (1 reads them with threads)')
+    parser.add_argument('--sort', type=str, choices=SORT_CHOICES, default='none', help='Order of code files: none keeps walk order (fastest), name or path sorts them')
 
     args = parser.parse_args()
     return args
 
 def cli_main():
     """命令行入口点函数"""
-    args = parse_args()
-    params = MainParams(
-        title=args.title,
-        version=args.version,
-        indirs=args.indirs,
-        exts=args.exts,
-        comment_chars=args.comment_chars,
-        font_name=args.font_name,
-        font_size=args.font_size,
-        max_front_pages=args.max_front_pages,
-        max_back_pages=args.max_back_pages,
-        excludes=args.excludes,
-        outfile=args.outfile,
-        verbose=args.verbose
-    )
-    return main(params)
+    # 命令行参数与 MainParams 的字段一一对应
+    return main(MainParams(**vars(parse_args())))
 
 if __name__ == '__main__':
     cli_main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from swcr.swcr import MainParams, main
+
+
+class FileListCacheTest(unittest.TestCase):
+    """缓存文件和输出文件都放在被扫描的目录中时，文件列表缓存仍应命中"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self._tmp.name)
+        os.mkdir(os.path.join(self.root, 'pkg'))
+        for name in ('main.py', os.path.join('pkg', 'util.py')):
+            with open(os.path.join(self.root, name), 'w') as f:
+                f.write('x = 1\n')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def run_swcr(self, cache_name='.swcr_cache'):
+        params = MainParams(indirs=[self.root], outfile=os.path.join(self.root, 'code.pdf'),
+                            cache=os.path.join(self.root, cache_name))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(main(params), 0)
+        return out.getvalue()
+
+    def test_in_tree_cache_and_output_hit(self):
+        self.assertNotIn('Loaded file list from cache', self.run_swcr())
+        self.assertIn('Loaded file list from cache', self.run_swcr())
+        self.assertIn('Loaded file list from cache', self.run_swcr())
+
+    def test_visible_cache_file_hits(self):
+        self.run_swcr('swcr.cache')
+        self.assertIn('Loaded file list from cache', self.run_swcr('swcr.cache'))
+
+    def test_new_code_file_invalidates(self):
+        self.run_swcr()
+        with open(os.path.join(self.root, 'pkg', 'new.py'), 'w') as f:
+            f.write('y = 2\n')
+        out = self.run_swcr()
+        self.assertNotIn('Loaded file list from cache', out)
+        self.assertIn('Found 3 code files', out)
+
+
+if __name__ == '__main__':
+    unittest.main()